@@ -1,6 +1,15 @@
 import os
+import hashlib
+from bisect import bisect_right
+from dataclasses import asdict
+from functools import cache, lru_cache
+from pathlib import Path
 from typing import Any
+import orjson
+import redis.asyncio as redis
 from dotenv import load_dotenv
+from openai.types.chat import ChatCompletion, ChatCompletionMessageToolCall
+from pydantic import PrivateAttr
 
 from factorial import (
     BaseAgent,
@@ -10,17 +19,66 @@ from factorial import (
     ModelSettings,
     gpt_41_mini,
     AgentWorkerConfig,
+    FunctionToolActionResult,
     deferred_result,
+    publish_progress,
+    retry,
 )
 
-current_dir = os.path.dirname(os.path.abspath(__file__))
-env_path = os.path.join(current_dir, ".env")
+ENV_PATH = Path(__file__).with_name(".env")
 
-load_dotenv(env_path, override=True)
+
+@cache
+def _load_env() -> bool:
+    """Load .env once per process; variables already set by the process manager win"""
+    return load_dotenv(ENV_PATH, override=False)
+
+
+_load_env()
 
 
 class IdeAgentContext(AgentContext):
     code: str
+    # Send the whole file with every edit instead of just the patch, for clients that need to resync
+    include_full_code: bool = False
+
+    _line_offsets: list[int] = PrivateAttr(default_factory=list)
+    _line_offsets_code: str | None = PrivateAttr(default=None)
+
+    def line_offsets(self) -> list[int]:
+        """Character offset of the start of each line in `code`, cached until `code` changes"""
+        if self._line_offsets_code is not self.code:
+            self._line_offsets = _compute_line_offsets(self.code)
+            self._line_offsets_code = self.code
+        return self._line_offsets
+
+    def splice_code(self, start: int, end: int, replacement: str) -> None:
+        """Replace `code[start:end]`, shifting the cached line offsets instead of rebuilding them"""
+        offsets = self.line_offsets()
+        delta = len(replacement) - (end - start)
+        lo = bisect_right(offsets, start)
+        hi = bisect_right(offsets, end)
+
+        new_offsets = [start + i + 1 for i in _newline_positions(replacement)]
+        new_offsets.extend(offset + delta for offset in offsets[hi:])
+        offsets[lo:] = new_offsets
+
+        self.code = self.code[:start] + replacement + self.code[end:]
+        self._line_offsets_code = self.code
+
+
+def _newline_positions(text: str) -> list[int]:
+    positions = []
+    append = positions.append
+    pos = text.find("\n")
+    while pos != -1:
+        append(pos)
+        pos = text.find("\n", pos + 1)
+    return positions
+
+
+def _compute_line_offsets(code: str) -> list[int]:
+    return [0] + [pos + 1 for pos in _newline_positions(code)]
 
 
 def think(thoughts: str) -> str:
@@ -39,57 +97,62 @@ def edit_code(
     Edit code in a file
 
     Arguments:
-    find: The text to find and replace
+    find: The text to find and replace (the first match within the given lines is replaced)
     find_start_line: The start line number where the 'find' text is located
     find_end_line: The end line number where the 'find' text is located
     replace: The text to replace the 'find' text with
     """
-    lines = agent_ctx.code.split("\n")
+    code = agent_ctx.code
+    line_offsets = agent_ctx.line_offsets()
 
     # Convert to 0-based indexing
     start_idx = find_start_line - 1
     end_idx = find_end_line - 1
 
     # Validate line numbers
-    if start_idx < 0 or end_idx >= len(lines) or start_idx > end_idx:
+    if start_idx < 0 or end_idx >= len(line_offsets) or start_idx > end_idx:
         return "Error: Invalid line numbers", {
             "error": "Line numbers out of range or invalid",
-            "total_lines": len(lines),
+            "total_lines": len(line_offsets),
         }
 
-    # Extract the text from the specified lines
-    existing_text = "\n".join(lines[start_idx : end_idx + 1])
+    # Character range covered by the specified lines, excluding the trailing newline
+    start = line_offsets[start_idx]
+    end = line_offsets[end_idx + 1] - 1 if end_idx + 1 < len(line_offsets) else len(code)
 
-    # Check if the find text matches what's at those line numbers
-    if find not in existing_text:
+    # Search for the find text only within those lines
+    find_idx = code.find(find, start, end)
+    if find_idx < 0:
         return (
             f"Error: Text '{find}' not found at lines {find_start_line}-{find_end_line}",
             {
                 "error": "Find text not found at specified lines",
-                "existing_text": existing_text,
+                "existing_text": code[start:end],
             },
         )
 
-    # Perform the replacement
-    new_text = existing_text.replace(find, replace)
-
-    # Replace the lines in the code
-    new_lines = lines[:start_idx] + new_text.split("\n") + lines[end_idx + 1 :]
-
-    # Update the agent context with the modified code
-    agent_ctx.code = "\n".join(new_lines)
+    # Replace the match in place and update the agent context with the modified code
+    agent_ctx.splice_code(find_idx, find_idx + len(find), replace)
+
+    # Clients apply the patch to their copy of the code rather than receiving the whole file
+    result = {
+        "find": find,
+        "find_start_line": find_start_line,
+        "find_end_line": find_end_line,
+        "replace": replace,
+        "patch": {
+            "start_offset": find_idx,
+            "end_offset": find_idx + len(find),
+            "replacement": replace,
+            "new_length": len(agent_ctx.code),
+        },
+    }
+    if agent_ctx.include_full_code:
+        result["new_code"] = agent_ctx.code
 
     return (
         f"Code successfully edited: replaced '{find}' with '{replace}' at lines {find_start_line}-{find_end_line}",
-        {
-            "find": find,
-            "find_start_line": find_start_line,
-            "find_end_line": find_end_line,
-            "replace": replace,
-            "old_text": existing_text,
-            "new_text": new_text,
-            "new_code": agent_ctx.code,
-        },
+        result,
     )
 
 
@@ -132,29 +195,147 @@ shown to the user in a diff editor.
 """
 
 
+class LLMResponseCache:
+    """Exact-match cache of chat completions in Redis, keyed on everything sent to the model"""
+
+    def __init__(
+        self,
+        redis_pool: redis.ConnectionPool,
+        ttl_seconds: int = 3600,
+        key_prefix: str = "ide_agent:llm_cache",
+    ):
+        self.redis_pool = redis_pool
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+
+    def key(
+        self,
+        model: str,
+        messages: list[dict[str, Any]],
+        tools: list[dict[str, Any]],
+        settings: dict[str, Any],
+    ) -> str | None:
+        """Cache key for the request, or None if sampling makes the response non-deterministic"""
+        if settings.get("temperature") != 0:
+            return None
+
+        request = orjson.dumps(
+            {"model": model, "messages": messages, "tools": tools, "settings": settings},
+            option=orjson.OPT_SORT_KEYS,
+            default=str,
+        )
+        return f"{self.key_prefix}:{hashlib.sha256(request).hexdigest()}"
+
+    async def get(self, key: str) -> ChatCompletion | None:
+        cached = await redis.Redis(connection_pool=self.redis_pool).get(key)
+        return ChatCompletion.model_validate_json(cached) if cached else None
+
+    async def set(self, key: str, response: ChatCompletion) -> None:
+        await redis.Redis(connection_pool=self.redis_pool).set(
+            key, response.model_dump_json(), ex=self.ttl_seconds
+        )
+
+
+# Turn 0 user message layout. Everything before the query is stable for a given
+# code file, so it stays a shared prefix for OpenAI's automatic prompt caching.
+CODE_MESSAGE_PREFIX = "Code file with line numbers:\n"
+QUERY_SEPARATOR = "\n---\nQuery: "
+
+
+class _ToolProgressContext:
+    """The context as it appears in tool_action progress events: everything but the
+    code and the message history, which both grow with the file"""
+
+    __slots__ = ("agent_ctx",)
+
+    def __init__(self, agent_ctx: IdeAgentContext):
+        self.agent_ctx = agent_ctx
+
+    def to_dict(self) -> dict[str, Any]:
+        return self.agent_ctx.model_dump(exclude={"code", "messages"})
+
+
 class IDEAgent(BaseAgent[IdeAgentContext]):
-    def __init__(self):
+    def __init__(self, response_cache: LLMResponseCache | None = None):
+        self.response_cache = response_cache
         super().__init__(
             context_class=IdeAgentContext,
             instructions=instructions,
             tools=[think, edit_code, request_code_execution],
             model=gpt_41_mini,
             model_settings=ModelSettings(
-                temperature=0.1,
+                temperature=0.0,
             ),
         )
+        # Shared by every turn 0 request; messages are only ever appended, never mutated
+        self._system_message = {"role": "system", "content": self.instructions}
+
+    async def completion(
+        self,
+        agent_ctx: IdeAgentContext,
+        messages: list[dict[str, Any]],
+    ) -> ChatCompletion:
+        """Serve identical requests from the response cache, replaying the cached tool calls"""
+        if self.response_cache is None:
+            return await super().completion(agent_ctx, messages)
+
+        cache_key = self.response_cache.key(
+            model=self.resolve_model(agent_ctx).name,
+            messages=messages,
+            tools=self.resolve_tools(agent_ctx),
+            settings=asdict(self.resolve_model_settings(agent_ctx)),
+        )
+        if cache_key is None:
+            return await super().completion(agent_ctx, messages)
+
+        cached = await self.response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        response = await super().completion(agent_ctx, messages)
+        await self.response_cache.set(cache_key, response)
+        return response
+
+    async def _tool_action_with_retry_and_progress(
+        self,
+        tool_call: ChatCompletionMessageToolCall,
+        agent_ctx: IdeAgentContext,
+    ) -> FunctionToolActionResult:
+        # Progress events carry the call's args, and the default wrapper passes the full
+        # context, so every edit_code event would resend the whole file next to its patch
+        return await self._tool_action_with_compact_progress(
+            tool_call, _ToolProgressContext(agent_ctx)
+        )
+
+    @retry(max_attempts=2, delay=0.25)
+    @publish_progress(func_name="tool_action")
+    async def _tool_action_with_compact_progress(
+        self,
+        tool_call: ChatCompletionMessageToolCall,
+        progress_ctx: _ToolProgressContext,
+    ) -> FunctionToolActionResult:
+        return await self.tool_action(tool_call, progress_ctx.agent_ctx)
 
     def prepare_messages(self, agent_ctx: IdeAgentContext) -> list[dict[str, Any]]:
+        # Static content first, dynamic last: instructions, then the append-only
+        # history, then the code, with the query at the very end. Later turns only
+        # append to these messages, so the prefix stays byte-identical across turns.
         if agent_ctx.turn == 0:
-            messages = [{"role": "system", "content": self.instructions}]
-            if agent_ctx.messages:
-                messages.extend(
-                    [message for message in agent_ctx.messages if message["content"]]
-                )
+            messages = [self._system_message]
+            messages.extend(
+                filter(lambda message: message["content"], agent_ctx.messages)
+            )
             messages.append(
                 {
                     "role": "user",
-                    "content": f"Code file with line numbers:\n{self.display_code_with_line_numbers(agent_ctx.code)}\n---\nQuery: {agent_ctx.query}",
+                    "content": "".join(
+                        [
+                            CODE_MESSAGE_PREFIX,
+                            self.display_code_with_line_numbers(agent_ctx.code),
+                            QUERY_SEPARATOR,
+                            agent_ctx.query,
+                        ]
+                    ),
                 }
             )
         else:
@@ -164,18 +345,33 @@ class IDEAgent(BaseAgent[IdeAgentContext]):
 
     def display_code_with_line_numbers(self, code: str) -> str:
         """Display code with line numbers"""
-        return "\n".join(
-            [f"[{i + 1}]{line}" for i, line in enumerate(code.split("\n"))]
-        )
+        return _render_with_line_numbers(code)
+
 
+# "[1]", "[2]", ... shared across renders, grown on demand
+_LINE_PREFIXES: list[str] = []
+
+
+def _ensure_prefixes(n: int) -> None:
+    if len(_LINE_PREFIXES) < n:
+        _LINE_PREFIXES.extend(f"[{i}]" for i in range(len(_LINE_PREFIXES) + 1, n + 1))
+
+
+@lru_cache(maxsize=128)
+def _render_with_line_numbers(code: str) -> str:
+    """Render code with line numbers, memoized so unchanged code is only rendered once"""
+    lines = code.split("\n")
+    _ensure_prefixes(len(lines))
+    return "\n".join(map(str.__add__, _LINE_PREFIXES, lines))
 
-ide_agent = IDEAgent()
 
 orchestrator = Orchestrator(
     redis_host=os.getenv("REDIS_HOST", "localhost"),
     openai_api_key=os.getenv("OPENAI_API_KEY"),
 )
 
+ide_agent = IDEAgent(response_cache=LLMResponseCache(orchestrator.redis_pool))
+
 orchestrator.register_runner(
     agent=ide_agent,
     agent_worker_config=AgentWorkerConfig(
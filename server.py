@@ -1,16 +1,186 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import queue
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import HTTPException
-from pydantic import BaseModel
-import json
-from typing import Any
+from fastapi.responses import ORJSONResponse
+import msgspec
+import orjson
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, TypeVar
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
+from factorial import BaseAgent, Orchestrator, Task
+from factorial.exceptions import InvalidTaskIdError
+from factorial.queue.keys import UPDATES_CHANNEL, RedisKeys
+from factorial.queue.lua import create_enqueue_task_script
+from factorial.utils import is_valid_task_id
+from redis.exceptions import NoScriptError
+
 from agent import ide_agent, orchestrator, IdeAgentContext
 
 
-app = FastAPI()
+@contextmanager
+def queue_logging() -> Iterator[None]:
+    """Route root logging through a queue drained by a background thread, so request
+    handlers never block on log I/O. Does nothing if a QueueHandler is already
+    installed, since `python server.py` imports this module twice (as __main__
+    and as server)."""
+    root_logger = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root_logger.handlers):
+        yield
+        return
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    queue_handler = QueueHandler(log_queue)
+    listener = QueueListener(log_queue, stream_handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(logging.INFO)
+    listener.start()
+    try:
+        yield
+    finally:
+        root_logger.removeHandler(queue_handler)
+        listener.stop()
+
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriberHub:
+    """One Redis pattern subscription for every owner's updates, fanned out in-process"""
+
+    def __init__(self, orchestrator: Orchestrator):
+        self.orchestrator = orchestrator
+        self.channel_prefix = UPDATES_CHANNEL.format(
+            namespace=orchestrator.namespace, owner_id=""
+        )
+        # The orchestrator's pool doesn't decode responses, so channels arrive as bytes
+        self._channel_prefix_len = len(self.channel_prefix.encode())
+        self.queues: defaultdict[str, set[asyncio.Queue[dict[str, Any]]]] = (
+            defaultdict(set)
+        )
+        self._reader: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        self._reader = asyncio.create_task(self._read_updates())
+
+    async def stop(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+
+    def register(self, owner_id: str) -> asyncio.Queue[dict[str, Any]]:
+        updates: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self.queues[owner_id].add(updates)
+        return updates
+
+    def unregister(self, owner_id: str, updates: asyncio.Queue[dict[str, Any]]) -> None:
+        owner_queues = self.queues.get(owner_id)
+        if owner_queues is None:
+            return
+        owner_queues.discard(updates)
+        if not owner_queues:
+            del self.queues[owner_id]
+
+    @asynccontextmanager
+    async def _subscription(self):
+        redis_client = await self.orchestrator.get_redis_client()
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.psubscribe(f"{self.channel_prefix}*")
+            yield pubsub
+        finally:
+            await pubsub.aclose()
+            await redis_client.aclose()
+
+    async def _read_updates(self) -> None:
+        while True:
+            try:
+                async with self._subscription() as pubsub:
+                    async for message in pubsub.listen():
+                        self._dispatch(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Updates subscription failed, resubscribing")
+                await asyncio.sleep(1.0)
+
+    def _dispatch(self, message: dict[str, Any]) -> None:
+        if message["type"] != "pmessage":
+            return
+        owner_id = message["channel"][self._channel_prefix_len :].decode()
+        owner_queues = self.queues.get(owner_id)
+        if not owner_queues:
+            return
 
+        try:
+            update = orjson.loads(message["data"])
+        except orjson.JSONDecodeError:
+            logger.error(f"Error decoding update: {message['data']}")
+            return
+
+        for updates in owner_queues:
+            updates.put_nowait(update)
+
+
+subscriber_hub = SubscriberHub(orchestrator)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    with queue_logging():
+        subscriber_hub.start()
+        yield
+        await subscriber_hub.stop()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+
+class UnhandledExceptionMiddleware:
+    """Turn unhandled errors in HTTP requests into JSON 500 responses. Added before
+    CORSMiddleware so it runs inside it and error responses keep their CORS headers.
+    Responding here (instead of using an Exception handler) also stops Starlette from
+    re-raising for uvicorn to log a second time."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_tracking_start(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracking_start)
+        except Exception as exc:
+            # Too late to send an error response once the headers are out
+            if response_started:
+                raise
+            logger.exception(f"Unhandled error in {scope['method']} {scope['path']}")
+            response = ORJSONResponse(status_code=500, content={"detail": str(exc)})
+            await response(scope, receive, send)
+
+
+app.add_middleware(UnhandledExceptionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -20,15 +190,37 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(msgspec.DecodeError)
+async def request_decode_error_handler(
+    request: Request, exc: msgspec.DecodeError
+) -> ORJSONResponse:
+    return ORJSONResponse(status_code=422, content={"detail": str(exc)})
+
+
+# Updates arriving within this window are coalesced into a single websocket frame
+WS_BATCH_WINDOW_SECONDS = 0.005
+WS_MAX_BATCH_SIZE = 100
+
+
 @app.websocket("/ws/{user_id}")
 async def websocket_updates(websocket: WebSocket, user_id: str):
+    """Stream updates to the client as JSON arrays, one frame per batch window"""
     await websocket.accept()
 
+    updates = subscriber_hub.register(user_id)
+
     try:
-        async for update in orchestrator.subscribe_to_updates(owner_id=user_id):
-            await websocket.send_text(json.dumps(update))
+        while True:
+            batch = [await updates.get()]
+            await asyncio.sleep(WS_BATCH_WINDOW_SECONDS)
+            while len(batch) < WS_MAX_BATCH_SIZE and not updates.empty():
+                batch.append(updates.get_nowait())
+
+            await websocket.send_bytes(orjson.dumps(batch))
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for user_id={user_id}")
+        logger.info(f"WebSocket disconnected for user_id={user_id}")
+    finally:
+        subscriber_hub.unregister(user_id, updates)
 
 
 @app.get("/")
@@ -36,25 +228,108 @@ def read_root():
     return {"Hello": "IDE Agent"}
 
 
-class EnqueueRequest(BaseModel):
+StructT = TypeVar("StructT", bound=msgspec.Struct)
+
+
+def msgspec_body(struct_type: type[StructT]) -> Callable[[Request], Awaitable[StructT]]:
+    """Dependency decoding the JSON request body straight into a msgspec Struct"""
+
+    async def decode_body(request: Request) -> StructT:
+        return msgspec.json.decode(await request.body(), type=struct_type)
+
+    return decode_body
+
+
+class EnqueueRequest(msgspec.Struct):
     user_id: str
     message_history: list[dict[str, str]]
     query: str
     code: str
+    include_full_code: bool = False
+
 
+class BulkEnqueueRequest(msgspec.Struct):
+    tasks: list[EnqueueRequest]
 
-class CancelRequest(BaseModel):
+
+class CancelRequest(msgspec.Struct):
     user_id: str
     task_id: str
 
 
+# Enqueue scripts sent per pipeline round trip (each script runs 7 Redis commands)
+ENQUEUE_PIPELINE_CHUNK_SIZE = 1_000
+
+
+async def create_agent_tasks_bulk(
+    agent: BaseAgent[Any],
+    owned_payloads: list[tuple[str, IdeAgentContext]],
+) -> list[Task[IdeAgentContext]]:
+    """Create and enqueue tasks for (owner_id, payload) pairs, pipelining the enqueue scripts"""
+    tasks = [
+        Task.create(owner_id=owner_id, agent=agent.name, payload=payload)
+        for owner_id, payload in owned_payloads
+    ]
+    for task in tasks:
+        if not is_valid_task_id(task.id):
+            raise InvalidTaskIdError(task.id)
+
+    # Keys and args mirror factorial.queue.operations.enqueue_task and must be
+    # kept in sync with it when upgrading nfactorial
+    keys = RedisKeys.format(namespace=orchestrator.namespace, agent=agent.name)
+    script_keys = [
+        keys.queue_main,
+        keys.task_status,
+        keys.task_agent,
+        keys.task_payload,
+        keys.task_pickups,
+        keys.task_retries,
+        keys.task_meta,
+    ]
+
+    async def enqueue_chunk(chunk: list[Task[IdeAgentContext]]) -> None:
+        # Raw EVALSHA so execute() doesn't add a SCRIPT EXISTS round trip per chunk
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for task in chunk:
+                pipe.evalsha(
+                    enqueue_script.sha,
+                    len(script_keys),
+                    *script_keys,
+                    task.id,
+                    agent.name,
+                    task.payload.to_json(),
+                    0,
+                    0,
+                    task.metadata.to_json(),
+                )
+            await pipe.execute()
+
+    redis_client = await orchestrator.get_redis_client()
+    try:
+        enqueue_script = await create_enqueue_task_script(redis_client)
+        for chunk_start in range(0, len(tasks), ENQUEUE_PIPELINE_CHUNK_SIZE):
+            chunk = tasks[chunk_start : chunk_start + ENQUEUE_PIPELINE_CHUNK_SIZE]
+            try:
+                await enqueue_chunk(chunk)
+            except NoScriptError:
+                await redis_client.script_load(enqueue_script.script)
+                await enqueue_chunk(chunk)
+    finally:
+        await redis_client.close()
+
+    return tasks
+
+
 @app.post("/api/enqueue")
-async def enqueue(request: EnqueueRequest):
+async def enqueue(
+    request: EnqueueRequest = Depends(msgspec_body(EnqueueRequest)),
+):
     payload = IdeAgentContext(
         messages=request.message_history,
         query=request.query,
         turn=0,
         code=request.code,
+        include_full_code=request.include_full_code,
     )
 
     task = await orchestrator.create_agent_task(
@@ -66,26 +341,47 @@ async def enqueue(request: EnqueueRequest):
     return {"task_id": task.id}
 
 
+@app.post("/api/enqueue_bulk")
+async def enqueue_bulk(
+    request: BulkEnqueueRequest = Depends(msgspec_body(BulkEnqueueRequest)),
+):
+    """Enqueue many tasks at once, one Redis round trip per pipeline chunk."""
+    tasks = await create_agent_tasks_bulk(
+        agent=ide_agent,
+        owned_payloads=[
+            (
+                task_request.user_id,
+                IdeAgentContext(
+                    messages=task_request.message_history,
+                    query=task_request.query,
+                    turn=0,
+                    code=task_request.code,
+                    include_full_code=task_request.include_full_code,
+                ),
+            )
+            for task_request in request.tasks
+        ],
+    )
+
+    return [{"task_id": task.id} for task in tasks]
+
+
 @app.post("/api/cancel")
-async def cancel_task_endpoint(request: CancelRequest) -> dict[str, Any]:
-    try:
-        await orchestrator.cancel_task(task_id=request.task_id)
+async def cancel_task_endpoint(
+    request: CancelRequest = Depends(msgspec_body(CancelRequest)),
+) -> dict[str, Any]:
+    await orchestrator.cancel_task(task_id=request.task_id)
 
-        print(
-            f"Task {request.task_id} marked for cancellation by user {request.user_id}"
-        )
-        return {
-            "success": True,
-            "message": f"Task {request.task_id} marked for cancellation",
-        }
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to cancel task {request.task_id}: {str(e)}",
-        )
+    logger.info(
+        f"Task {request.task_id} marked for cancellation by user {request.user_id}"
+    )
+    return {
+        "success": True,
+        "message": f"Task {request.task_id} marked for cancellation",
+    }
 
 
-class CompleteToolRequest(BaseModel):
+class CompleteToolRequest(msgspec.Struct):
     user_id: str
     task_id: str
     tool_call_id: str
@@ -93,24 +389,34 @@ class CompleteToolRequest(BaseModel):
 
 
 @app.post("/api/complete_tool")
-async def complete_deferred_tool_endpoint(request: CompleteToolRequest):
+async def complete_deferred_tool_endpoint(
+    request: CompleteToolRequest = Depends(msgspec_body(CompleteToolRequest)),
+):
     """Complete a deferred tool call with the provided result."""
-    try:
-        success = await orchestrator.complete_deferred_tool(
-            task_id=request.task_id,
-            tool_call_id=request.tool_call_id,
-            result=request.result,
-        )
+    success = await orchestrator.complete_deferred_tool(
+        task_id=request.task_id,
+        tool_call_id=request.tool_call_id,
+        result=request.result,
+    )
 
-        if success:
-            return {"success": True}
-        raise HTTPException(status_code=500, detail="Unable to complete deferred tool.")
-    except Exception as e:
-        print(f"Failed to complete deferred tool call {request.tool_call_id}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    if success:
+        return {"success": True}
+    raise HTTPException(status_code=500, detail="Unable to complete deferred tool.")
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="httptools",
+        ws="websockets",
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
+        timeout_keep_alive=75,
+        backlog=2048,
+        limit_concurrency=1000,
+    )
@@ -0,0 +1,37 @@
+import asyncio
+
+import fakeredis
+import orjson
+import redis.asyncio as redis
+
+from factorial.queue.keys import UPDATES_CHANNEL
+from server import SubscriberHub, orchestrator
+
+
+def test_owner_update_reaches_registered_queue(monkeypatch):
+    server = fakeredis.FakeServer()
+    # Like the real orchestrator pool, this one returns bytes
+    monkeypatch.setattr(
+        orchestrator,
+        "redis_pool",
+        redis.ConnectionPool(connection_class=fakeredis.FakeAsyncRedisConnection, server=server),
+    )
+    publisher = fakeredis.FakeRedis(server=server)
+    channel = UPDATES_CHANNEL.format(namespace=orchestrator.namespace, owner_id="u1")
+
+    async def run() -> None:
+        hub = SubscriberHub(orchestrator)
+        updates = hub.register("u1")
+        other_updates = hub.register("u2")
+        hub.start()
+        try:
+            while not publisher.publish(channel, orjson.dumps({"event_type": "test"})):
+                await asyncio.sleep(0.01)
+            assert await asyncio.wait_for(updates.get(), timeout=1) == {
+                "event_type": "test"
+            }
+            assert other_updates.empty()
+        finally:
+            await hub.stop()
+
+    asyncio.run(run())
@@ -31,6 +31,8 @@ function App() {
   const [code, setCode] = useState(STARTER_CODE);
   // Hold a potential code update coming from the agent that the user can accept/reject
   const [proposedCode, setProposedCode] = useState<string | null>(null);
+  // The agent's copy of the code per running task, kept in sync by applying edit patches
+  const taskCodeRef = useRef<Record<string, string>>({});
   
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
@@ -65,6 +67,7 @@ function App() {
     setCurrentTaskId,
     setCancelling,
     setProposedCode,
+    taskCodeRef,
   });
 
   // Initialize chat functionality
@@ -74,6 +77,7 @@ function App() {
     currentTaskId,
     cancelling,
     code: proposedCode ?? code,
+    taskCodeRef,
     setInput,
     setLoading,
     setCurrentTaskId,
@@ -423,7 +427,7 @@ function App() {
                         );
                       }
                     }
-                    if (typeof (action.result as { new_code?: string } | undefined)?.new_code !== 'undefined') return null; // diff handled elsewhere
+                    if (typeof (action.result as { patch?: unknown } | undefined)?.patch !== 'undefined') return null; // diff handled elsewhere
                     return (
                       <div key={action.id} className="text-xs text-gray-400">Tool {action.toolName} completed</div>
                     );
@@ -1,4 +1,5 @@
 import { useCallback } from 'react';
+import type { MutableRefObject } from 'react';
 import type { Action } from '../types/run';
 import { useRuns } from '../context/RunContext';
 import { API_BASE } from '../constants';
@@ -9,6 +10,7 @@ interface UseChatProps {
   currentTaskId: string | null;
   cancelling: boolean;
   code: string;
+  taskCodeRef: MutableRefObject<Record<string, string>>;
   setInput: (input: string) => void;
   setLoading: (loading: boolean) => void;
   setCurrentTaskId: (taskId: string | null) => void;
@@ -21,6 +23,7 @@ export const useChat = ({
   currentTaskId,
   cancelling,
   code,
+  taskCodeRef,
   setInput,
   setLoading,
   setCurrentTaskId,
@@ -54,6 +57,7 @@ export const useChat = ({
 
     if (res.ok) {
       const { task_id } = await res.json();
+      taskCodeRef.current[task_id] = code;
       createRun(task_id, input);
       setCurrentTaskId(task_id);
 
@@ -70,7 +74,7 @@ export const useChat = ({
       console.error('enqueue failed');
       setLoading(false);
     }
-  }, [input, userId, code, setInput, setLoading, createRun, addAction, setCurrentTaskId, runs, runOrder]);
+  }, [input, userId, code, taskCodeRef, setInput, setLoading, createRun, addAction, setCurrentTaskId, runs, runOrder]);
 
   const cancelCurrentTask = useCallback(async () => {
     if (!currentTaskId || cancelling) return;
@@ -1,15 +1,45 @@
 import { useCallback, useRef, useEffect } from 'react';
-import type { AgentEvent } from '../types';
+import type { MutableRefObject } from 'react';
+import type { AgentEvent, CodePatch, EditCodeResult } from '../types';
 import { WS_BASE } from '../constants';
 import { useRuns } from '../context/RunContext';
 import type { Action } from '../types/run';
 
+const textDecoder = new TextDecoder();
+
+const SURROGATES = /[\uD800-\uDFFF]/;
+
+// Advance `codePoints` code points from UTF-16 index `from`
+const advanceCodePoints = (text: string, from: number, codePoints: number): number => {
+  let index = from;
+  for (let i = 0; i < codePoints && index < text.length; i++) {
+    index += text.codePointAt(index)! > 0xffff ? 2 : 1;
+  }
+  return index;
+};
+
+// Returns null when the result doesn't match the agent's copy, so the caller can resync
+const applyPatch = (text: string, patch: CodePatch): string | null => {
+  let start = patch.start_offset;
+  let end = patch.end_offset;
+  if (SURROGATES.test(text)) {
+    start = advanceCodePoints(text, 0, patch.start_offset);
+    end = advanceCodePoints(text, start, patch.end_offset - patch.start_offset);
+  }
+
+  const updated = text.slice(0, start) + patch.replacement + text.slice(end);
+  const length = SURROGATES.test(updated) ? [...updated].length : updated.length;
+  return length === patch.new_length ? updated : null;
+};
+
 interface UseWebSocketProps {
   userId: string;
   setLoading: (loading: boolean) => void;
   setCurrentTaskId: (taskId: string | null) => void;
   setCancelling: (cancelling: boolean) => void;
   setProposedCode: (code: string) => void;
+  // The agent's current copy of the code for each running task, which edit patches apply to
+  taskCodeRef: MutableRefObject<Record<string, string>>;
 }
 
 export const useWebSocket = ({
@@ -18,12 +48,14 @@ export const useWebSocket = ({
   setCurrentTaskId,
   setCancelling,
   setProposedCode,
+  taskCodeRef,
 }: UseWebSocketProps) => {
   const wsRef = useRef<WebSocket | null>(null);
+  // Tasks whose edits couldn't be patched locally; their code is taken from the end of the turn
+  const resyncTaskIdsRef = useRef<Set<string>>(new Set());
   const { addAction, updateAction } = useRuns();
 
-  const handleWSMessage = useCallback((evt: MessageEvent) => {
-    const event: AgentEvent = JSON.parse(evt.data);
+  const handleEvent = useCallback((event: AgentEvent) => {
     console.log('WS event:', event);
 
     switch (event.event_type) {
@@ -53,8 +85,18 @@ export const useWebSocket = ({
         if (!toolCall) break;
 
         // If this is an edit_code tool completion, propose the code change
-        if (toolCall.function.name === 'edit_code' && resp.output_data?.new_code) {
-          setProposedCode(resp.output_data.new_code);
+        if (toolCall.function.name === 'edit_code' && resp.output_data?.patch) {
+          const { patch, new_code } = resp.output_data as EditCodeResult;
+          const taskCode = taskCodeRef.current[event.task_id];
+          const updatedCode = new_code ?? (taskCode !== undefined ? applyPatch(taskCode, patch) : null);
+          if (updatedCode !== null) {
+            taskCodeRef.current[event.task_id] = updatedCode;
+            setProposedCode(updatedCode);
+          } else {
+            // No base to patch (e.g. after a reconnect) or it has drifted: wait for the full code
+            delete taskCodeRef.current[event.task_id];
+            resyncTaskIdsRef.current.add(event.task_id);
+          }
         }
 
         if (toolCall.function.name === 'request_code_execution') {
@@ -107,8 +149,20 @@ export const useWebSocket = ({
         break;
       }
 
+      case 'progress_update_run_turn_completed': {
+        // The turn's result carries the agent's full context, including the code
+        const agentCode = event.data?.result?.context?.code;
+        if (typeof agentCode !== 'string' || !resyncTaskIdsRef.current.delete(event.task_id)) break;
+
+        taskCodeRef.current[event.task_id] = agentCode;
+        setProposedCode(agentCode);
+        break;
+      }
+
       case 'agent_output': {
         const content: string = event.data;
+        delete taskCodeRef.current[event.task_id];
+        resyncTaskIdsRef.current.delete(event.task_id);
 
         const answerAction: Action = {
           id: `answer_${Date.now()}`,
@@ -124,6 +178,8 @@ export const useWebSocket = ({
       }
 
       case 'run_cancelled': {
+        delete taskCodeRef.current[event.task_id];
+        resyncTaskIdsRef.current.delete(event.task_id);
         const notice: Action = {
           id: `cancel_${Date.now()}`,
           kind: 'system_notice',
@@ -139,6 +195,8 @@ export const useWebSocket = ({
       }
 
       case 'run_failed': {
+        delete taskCodeRef.current[event.task_id];
+        resyncTaskIdsRef.current.delete(event.task_id);
         const notice: Action = {
           id: `fail_${Date.now()}`,
           kind: 'system_notice',
@@ -156,10 +214,17 @@ export const useWebSocket = ({
       default:
         console.log('Unhandled event:', event);
     }
-  }, [setLoading, setCurrentTaskId, setCancelling, setProposedCode, addAction, updateAction]);
+  }, [setLoading, setCurrentTaskId, setCancelling, setProposedCode, taskCodeRef, addAction, updateAction]);
+
+  // The server batches updates, sending each frame as a binary JSON array of events
+  const handleWSMessage = useCallback((evt: MessageEvent<ArrayBuffer>) => {
+    const events: AgentEvent[] = JSON.parse(textDecoder.decode(evt.data));
+    events.forEach(handleEvent);
+  }, [handleEvent]);
 
   useEffect(() => {
     const ws = new WebSocket(`${WS_BASE}/${userId}`);
+    ws.binaryType = 'arraybuffer';
     ws.onmessage = handleWSMessage;
     wsRef.current = ws;
     return () => ws.close();
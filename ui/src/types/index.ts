@@ -31,4 +31,19 @@ export interface Message {
     content   : string;
     timestamp : Date;
     thinking ?: ThinkingProgress;
-} 
\ No newline at end of file
+}
+
+// Offsets count Unicode code points, matching Python string indices on the server
+export interface CodePatch {
+    start_offset : number;
+    end_offset   : number;
+    replacement  : string;
+    new_length   : number;
+}
+
+export interface EditCodeResult {
+    find_start_line : number;
+    find_end_line   : number;
+    patch           : CodePatch;
+    new_code?       : string;
+}